@@ -1,12 +1,12 @@
-from pathlib import Path
 import numpy as np
 import shutil
 import time
 import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import logging
 import sys
 import os
-import operator as op
+import re
 # CSB-Run utility functions
 import utils
 
@@ -31,6 +31,18 @@ end_year = sys.argv[2]
 creation_dir = sys.argv[3] # create_1421_20220511_1
 partial_area = sys.argv[4] # partial run area e.g. G9 or 'None'
 
+# split raster file names are <area>_<year>_<tile>.tif, compiled once here
+split_raster_re = re.compile(r'^(?P<area>.+)_(?P<year>\d{4})_(?P<tile>\d+)\.tif$', re.IGNORECASE)
+
+# config items, read once per process
+cfg = utils.GetConfig('default')
+
+# scratch gdb shared by every area a pool worker runs, set by WorkerGdb.
+# the elimination intermediates are in memory\ now, but it is still the
+# scratchWorkspace the arcpy tools write their own temporary data to, so
+# parallel workers don't all share the default scratch gdb
+worker_temp_gdb = None
+
 # projection
 coor_str=r'PROJCS["USA_Contiguous_Albers_Equal_Area_Conic_USGS_version",GEOGCS["GCS_North_American_1983",DATUM["D_North_American_1983",SPHEROID["GRS_1980",6378137.0,298.257222101]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],PROJECTION["Albers"],PARAMETER["False_Easting",0.0],PARAMETER["False_Northing",0.0],PARAMETER["Central_Meridian",-96.0],PARAMETER["Standard_Parallel_1",29.5],PARAMETER["Standard_Parallel_2",45.5],PARAMETER["Latitude_Of_Origin",23.0],UNIT["Meter",1.0]]'
 
@@ -39,309 +51,334 @@ Output_Coordinate_System_2_ = "PROJCS[\"Albers_Conic_Equal_Area\",GEOGCS[\"GCS_N
 
 
 # Main function that creates CSB datasets, performs elimination,run using multiprocessing
-def CSB_process(start_year, end_year, area):
-    
-    # Get config items, configure logger
-    cfg = utils.GetConfig('default')
+def CSB_process(start_year, end_year, area, n_tiles):
     
+    # configure logger, workers are reused across areas so each area gets its
+    # own named logger rather than basicConfig (which only applies once per process)
     LOG_FORMAT = "%(levelname)s %(asctime)s - %(message)s"
-    logging.basicConfig(filename= f'{creation_dir}/log/{area}.log',
-                        level=logging.DEBUG, #by default it only log warming or above
-                        format=LOG_FORMAT,
-                        filemode='a')  # over write instead of appending
-    logger = logging.getLogger()
-    error_path = f'{creation_dir}/log/overall_error.txt'
+    logger = logging.getLogger(area)
+    logger.setLevel(logging.DEBUG) #by default it only log warming or above
+    if not logger.handlers:
+        log_handler = logging.FileHandler(f'{creation_dir}/log/{area}.log', mode='a')
+        log_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(log_handler)
+        # errors from every area also go to one shared overall_error.txt,
+        # the handler keeps the file open instead of reopening it per error
+        error_handler = logging.FileHandler(f'{creation_dir}/log/overall_error.txt', mode='a', delay=True)
+        error_handler.setLevel(logging.ERROR)
+        error_handler.setFormatter(logging.Formatter("%(name)s %(asctime)s - %(message)s"))
+        logger.addHandler(error_handler)
+    
+    try:
+        # Set up list of years covered in history
+        year_lst = list(range(int(start_year), int(end_year) + 1))
+
+        # get file names for each tile of the area across the different years,
+        # n_tiles is counted from the start year when __main__ scans the areas
+        split_rasters = cfg["folders"]["split_rasters"]
+        tile_file_lst = [[f'{split_rasters}/{year}/{area}_{year}_{i}.TIF' for year in year_lst]
+                         for i in range(n_tiles)]
     
-    # Set up list of years covered in history
-    year_lst = []
-    for i in range(int(start_year), int(end_year) + 1):
-        year_lst.append(i)
-
-    # get file name for same area across different years
-    year_file_lst = []
-    for year in year_lst:
-        filePath = f'{cfg["folders"]["split_rasters"]}/{year}/' 
-        file_obj = Path(filePath).rglob(f'{area}_{year}*.tif')
-        file_lst = [x.__str__() for x in file_obj]
-        sort_file_lst = []
-        for i in range(len(file_lst)):
-            path = f'{filePath}/{area}_{year}_{i}.TIF'
-            sort_file_lst.append(path)
-        year_file_lst.append(sort_file_lst)
-
-    createGDB = False
-    while createGDB == False:
-        try:
-            t0 = time.perf_counter()
-            print(f"{area}: Creating GDBs")
-            logger.info(f"{area}: Creating GDBs")
-            arcpy.CreateFileGDB_management(out_folder_path= f'{creation_dir}/Vectors_LL',
-                                            out_name=f"{area}_{str(start_year)}-{str(end_year)}.gdb",
-                                            out_version="CURRENT")
-            arcpy.CreateFileGDB_management(out_folder_path= f'{creation_dir}/Vectors_Out',
-                                            out_name=f"{area}_{str(start_year)}-{str(end_year)}_OUT.gdb",
-                                            out_version="CURRENT")
-            arcpy.CreateFileGDB_management(out_folder_path= f'{creation_dir}/Vectors_temp',
-                                            out_name=f"{area}_{str(start_year)}-{str(end_year)}_temp.gdb",
-                                            out_version="CURRENT")
-            arcpy.CreateFileGDB_management(out_folder_path= f'{creation_dir}/Vectors_In/',
-                                            out_name=f"{area}_{str(start_year)}-{str(end_year)}_In.gdb",
-                                            out_version="CURRENT")
-            createGDB = True
-            
-        except Exception as e:
-            error_msg = e.args
-            logger.error(error_msg)
-            f = open(error_path,'a')
-            f.write(''.join(str(item) for item in error_msg))
-            f.close()
-            sys.exit(0)
-        except:
-            error_msg = arcpy.GetMessage(0)
-            logger.error(error_msg)
-            f = open(error_path,'a')
-            f.write(''.join(str(item) for item in error_msg))
-            f.close()
-            sys.exit(0)    
+        # fail fast if any year is missing a tile rather than part way through
+        missing = [path for tile in tile_file_lst for path in tile if not os.path.isfile(path)]
+        if missing:
+            raise FileNotFoundError(f'{area}: missing split rasters {missing}')
+
+        # names for this area's history window, built once and reused below
+        area_years = f'{area}_{start_year}-{end_year}'
+        out_gdb = f'{creation_dir}/Vectors_Out/{area_years}_OUT.gdb'
+        temp_gdb = WorkerGdb(logger)
+        in_gdb = f'{creation_dir}/Vectors_In/{area_years}_In.gdb'
+
+        # create the area gdbs, skipping any that already exist (e.g. restarted run)
+        t0 = time.perf_counter()
+        print(f"{area}: Creating GDBs")
+        logger.info(f"{area}: Creating GDBs")
+        for gdb in [out_gdb, in_gdb]:
+            if arcpy.Exists(gdb):
+                continue
+            utils.Retry(logger, tries=5, wait=1, backoff=2)(arcpy.CreateFileGDB_management)(
+                out_folder_path=os.path.dirname(gdb), out_name=os.path.basename(gdb),
+                out_version="CURRENT")
  
-    print(f"{area}: Start Combine")
-    logger.info(f"{area}: Start Combine")
-    for i in range(len(file_lst)):
-        lst = [j[i] for j in year_file_lst]
-        input_path = ';'.join(lst)
-        output_path = f'{creation_dir}/CombineALL/{area}_{i}_{start_year}-{end_year}.tif'
-        arcpy.gp.Combine_sa(input_path, output_path)
-        logger.info(f"{area}_{i}: Combine Done, Adding Field")
-        
-        columnList = [i.name for i in arcpy.ListFields(output_path)]
-        while 'COUNT0' not in columnList:
+        print(f"{area}: Start Combine")
+        logger.info(f"{area}: Start Combine")
+        for i, lst in enumerate(tile_file_lst):
+            # the SetNull raster is only read once by RasterToPolygon, so it is kept
+            # in the memory workspace rather than written out to Combine/
+            setNull_path = rf'memory\{area}_{i}_{start_year}_{end_year}_NULL'
+            combine_file = f'{creation_dir}/Combine/{area}_{i}_{start_year}-{end_year}.dat'
+            CombineSetNull(lst, setNull_path, combine_file)
+            logger.info(f"{area}_{i}: Combine and SetNull Done")
+
+            # Convert Raster to Vector, the polygons are written out already
+            # projected so there is no separate Project step
+            logger.info(f"{area}_{i}: Convert Raster to Vector")
+            out_feature_In = f'{in_gdb}/{area}_{i}_In'
+            # the worker outlives this area, so the in-memory raster is deleted
+            # even if RasterToPolygon fails
             try:
-                arcpy.AddField_management(in_table=output_path, field_name="COUNT0", field_type="SHORT", field_precision="",
-                                          field_scale="", field_length="", field_alias="", field_is_nullable="NON_NULLABLE",
-                                          field_is_required="NON_REQUIRED", field_domain="")
-                columnList = [i.name for i in arcpy.ListFields(output_path)]
-                
-            except Exception as e:
-                error_msg = e.args
-                logger.error(error_msg)
-                f = open(error_path, 'a')
-                f.write(''.join(str(item) for item in error_msg))
-                f.close()
-                time.sleep(2)
-                print(f'{area}: try again add field')
-                logger.info(f'{area}: try again add field')
-                arcpy.AddField_management(in_table=output_path, field_name="COUNT0", field_type="SHORT", field_precision="",
-                                          field_scale="", field_length="", field_alias="", field_is_nullable="NON_NULLABLE",
-                                          field_is_required="NON_REQUIRED", field_domain="")
-                columnList = [i.name for i in arcpy.ListFields(output_path)]
-
-            except:
-                error_msg = arcpy.GetMessage(0)
-                logger.error(error_msg)
-                f = open(error_path, 'a')
-                f.write(''.join(str(item) for item in error_msg))
-                f.close()
-                time.sleep(2)
-                print(f'{area}: try again add field')
-                logger.info(f'{area} try again add field')
-                arcpy.AddField_management(in_table=output_path, field_name="COUNT0", field_type="SHORT", field_precision="",
-                                          field_scale="", field_length="", field_alias="", field_is_nullable="NON_NULLABLE",
-                                          field_is_required="NON_REQUIRED", field_domain="")
-                columnList = [i.name for i in arcpy.ListFields(output_path)]
-
-        # generate experession string
-        logger.info(f'{area}_{i}: Calculate Field')
-        calculate_field_lst = [r'!'+f'{area}_{j}_{i}'[0:10]+r'!' for j in year_lst]
-        cal_expression = f"CountFieldsGreaterThanZero([{','.join(calculate_field_lst)}])"
-        code = "def CountFieldsGreaterThanZero(fieldList): \n  counter = 0 \n  for field in fieldList: \n    if field > 0: \n      counter += 1 \n  return counter"
-        try:
-            arcpy.CalculateField_management(in_table=output_path,
-                                            field="COUNT0",
-                                            expression=cal_expression,
-                                            code_block=code)
-        except Exception as e:
-            error_msg = e.args
-            logger.error(error_msg)
-            f = open(error_path, 'a')
-            f.write(''.join(str(item) for item in error_msg))
-            f.write(r'/n')
-            f.close()
-            sys.exit(0)
-        except:
-            error_msg = arcpy.GetMessage(0)
-            logger.error(error_msg)
-            f = open(error_path, 'a')
-            f.write(''.join(str(item) for item in error_msg))
-            f.write(r'/n')
-            f.close()
-            sys.exit(0)
-
-
-        # Start SetNull
-        logger.info(f'{area}_{i}: Start SetNull')
-        setNull_path = f'{creation_dir}/Combine/{area}_{i}_{start_year}-{end_year}_NULL.tif'
-        arcpy.gp.SetNull_sa(output_path,
-                            output_path,
-                            setNull_path,
-                            '"COUNT0" < 1.1') 
-
-        # Convert Raster to Vector
-        logger.info(f"{area}_{i}: Convert Raster to Vector")
-        out_feature_LL = f'{creation_dir}/Vectors_LL/{area}_{start_year}-{end_year}.gdb/{area}_{i}_In'
-        arcpy.RasterToPolygon_conversion(in_raster=setNull_path,
-                                          out_polygon_features=out_feature_LL,
-                                          simplify="SIMPLIFY", raster_field="Value",
-                                          create_multipart_features="SINGLE_OUTER_PART", max_vertices_per_feature="")
+                with arcpy.EnvManager(outputCoordinateSystem=coor_str):
+                    arcpy.RasterToPolygon_conversion(in_raster=setNull_path,
+                                                      out_polygon_features=out_feature_In,
+                                                      simplify="SIMPLIFY", raster_field="Value",
+                                                      create_multipart_features="SINGLE_OUTER_PART", max_vertices_per_feature="")
+            finally:
+                arcpy.management.Delete(setNull_path)
 
 
-        
-        logger.info(f"{area}_{i}: Projection")
-        out_feature_In = f'{creation_dir}/Vectors_In/{area}_{start_year}-{end_year}_In.gdb/{area}_{i}_In'
-        arcpy.management.Project(in_dataset=out_feature_LL, out_dataset=out_feature_In,
-                                  out_coor_system=coor_str,
-                                  transform_method=[], in_coor_system="", preserve_shape="NO_PRESERVE_SHAPE",
-                                  max_deviation="", vertical="NO_VERTICAL")
-
+        t1 = time.perf_counter()
+        print(f'Time to finish all the steps before Elimination for {area}: {round((t1 - t0) / 60, 2)} minutes')
+        logger.info(f'Time to finish all the steps before Elimination for {area}: {round((t1 - t0) / 60, 2)} minutes')
 
-    t1 = time.perf_counter()
-    print(f'Time to finish all the steps before Elimination for {area}: {round((t1 - t0) / 60, 2)} minutes')
-    logger.info(f'Time to finish all the steps before Elimination for {area}: {round((t1 - t0) / 60, 2)} minutes')
+        logger.info(f"{area}: Elimination"); print(f"{area}: Elimination")
+    
+        # the intermediate elimination passes are kept in memory, clear anything a
+        # previous failed area left there
+        with arcpy.EnvManager(workspace='memory'):
+            old_fcs = arcpy.ListFeatureClasses()
+        if old_fcs:
+            arcpy.management.Delete([rf'memory\{fc}' for fc in old_fcs])
+    
+        # each tile gets one repair, if it fails again after that the problem
+        # isn't its geometry (locks, disk space, ...) so the area fails instead
+        repaired_tiles = set()
+        eliminate_success = False
+        while eliminate_success == False:
+            try:
+                with arcpy.EnvManager(scratchWorkspace=temp_gdb, workspace=temp_gdb):
+                    CSBElimination(Input_Layers=in_gdb, Workspace=out_gdb, Scratch='memory',
+                                   area_logger=logger)
+                eliminate_success = True
+        
+            except EliminationError as e:
+                    error_msg = e.args
+                    logger.error(error_msg); print(f'{area}: {error_msg}')
+                    if e.tile in repaired_tiles:
+                        logger.error(f'{e.tile}: failed again after repair geometry, giving up on {area}')
+                        raise
+                    repaired_tiles.add(e.tile)
+                    # finished tiles are skipped on the retry, so drop any Out_
+                    # the failed tile wrote part way through its last pass
+                    failed_out = f'{out_gdb}/Out_{e.tile}'
+                    if arcpy.Exists(failed_out):
+                        arcpy.management.Delete(failed_out)
+                    RepairTopology(in_gdb, e.tile, logger)
+    
 
-    logger.info(f"{area}: Elimination"); print(f"{area}: Elimination")
+        t2 = time.perf_counter()
+        print(f'Time that Elimination takes for {area}: {round((t2 - t1) / 60, 2)} minutes')
+        logger.info(f'Time that Elimination takes for {area}: {round((t2 - t1) / 60, 2)} minutes')
+
+        for i in range(n_tiles):
+            logger.info(f"{area}_{i}: Select analysis")
+            arcpy.Select_analysis(
+                in_features=f'{out_gdb}/Out_{area}_{i}_In',
+                out_feature_class=f'{creation_dir}/Vectors_Out/{area}_{i}_{start_year}_{end_year}_Out.shp',
+                where_clause="Shape_Area >10000")
+
+        t3 = time.perf_counter()
+        print(f'Total time for {area}: {round((t3 - t0) / 60, 2)} minutes')
+        logger.info(f'Total time for {area}: {round((t3 - t0) / 60, 2)} minutes')
+        return(f'Finished {area}')
+    except Exception:
+        # every failure reaches the area log and overall_error.txt with its
+        # traceback, the parent only sees the exception itself
+        logger.exception(f'{area}: failed')
+        raise
+    finally:
+        # the worker goes on to other areas, close this area's log files
+        # whether it finished or failed
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+            handler.close()
+
+
+# rows of a tile read and combined at a time, bounds the size of the year stack
+block_rows = 1024
+
+
+# NumPy version of Combine_sa -> COUNT0 -> SetNull_sa: gives each unique
+# sequence of yearly values its own id and sets pixels that had a crop in
+# fewer than min_count years to NoData, writing only the final raster
+def CombineSetNull(year_rasters, out_raster, combine_file, min_count=2):
+    ref = arcpy.Raster(year_rasters[0])
+    n_rows, n_cols = ref.height, ref.width
     
-    eliminate_success = False
-    while eliminate_success == False:
-        try:
-            with arcpy.EnvManager(scratchWorkspace=f'{creation_dir}/Vectors_temp/{area}_{start_year}-{end_year}_temp.gdb', 
-                                  workspace=f'{creation_dir}/Vectors_temp/{area}_{start_year}-{end_year}_temp.gdb'):
-                CSBElimination(Input_Layers= f'{creation_dir}/Vectors_In/{area}_{start_year}-{end_year}_In.gdb',
-                Workspace= f'{creation_dir}/Vectors_Out/{area}_{start_year}-{end_year}_OUT.gdb',
-                Scratch= f'{creation_dir}/Vectors_temp/{area}_{start_year}-{end_year}_temp.gdb')
-            eliminate_success = True
+    # the tile is processed in blocks of rows, ids are kept in one dict so the
+    # same sequence gets the same id in every block. The output grid is
+    # memory-mapped to combine_file so the OS pages it instead of it all
+    # sitting in RAM for large tiles
+    combine = np.memmap(combine_file, dtype=np.int32, mode='w+', shape=(n_rows, n_cols))
+    try:
+        sequence_ids = {}
+        for r0 in range(0, n_rows, block_rows):
+            rows = min(block_rows, n_rows - r0)
+            lower_left = arcpy.Point(ref.extent.XMin, ref.extent.YMax - (r0 + rows) * ref.meanCellHeight)
+            stack = np.stack([arcpy.RasterToNumPyArray(r, lower_left, n_cols, rows, nodata_to_value=0)
+                              for r in year_rasters])
         
-        except Exception as e:
-                error_msg = e.args
-                logger.error(error_msg); print(f'{area}: {error_msg}')
-                f = open(error_path, 'a')
-                f.write(''.join(str(item) for item in error_msg))
-                f.write(r'/n')
-                f.close()
-                RepairTopology(f'{creation_dir}/Vectors_In/{area}_{start_year}-{end_year}_In.gdb',
-                                f'{creation_dir}/Vectors_temp/{area}_{start_year}-{end_year}_temp.gdb',
-                                area, logger)
-        except:
-                error_msg = arcpy.GetMessage(0)
-                logger.error(error_msg)
-                f = open(error_path, 'a')
-                f.write(''.join(str(item) for item in error_msg))
-                f.write(r'/n')
-                f.close()
-                sys.exit(0)
+            # apply the SetNull mask first so only the kept pixels get sorted into ids,
+            # the count is built one year at a time in uint8 so there is no full
+            # size boolean stack or int64 sum
+            count = np.zeros((rows, n_cols), dtype=np.uint8)
+            for band in stack:
+                count += band > 0
+            keep = count >= min_count
+            if not keep.any():
+                continue
+            kept = stack[:, keep]
+            if kept.dtype == np.uint8 and len(kept) <= 8:
+                # up to 8 years of uint8 crop codes fit in one uint64 per pixel,
+                # np.unique sorts those much faster than columns and in the same order
+                packed = np.zeros(kept.shape[1], dtype=np.uint64)
+                for band in kept:
+                    packed = (packed << np.uint64(8)) | band
+                sequences, inverse = np.unique(packed, return_inverse=True)
+                block_keys = sequences.tolist()
+            else:
+                sequences, inverse = np.unique(kept, axis=1, return_inverse=True)
+                block_keys = [seq.tobytes() for seq in sequences.T]
+            block_ids = np.array([sequence_ids.setdefault(key, len(sequence_ids) + 1)
+                                  for key in block_keys], dtype=np.int32)
+            combine[r0:r0 + rows][keep] = block_ids[inverse.ravel()]
+            combine.flush()
     
+        # the raster is only read once by RasterToPolygon, so skip building
+        # pyramids and statistics when it is saved
+        with arcpy.EnvManager(outputCoordinateSystem=ref.spatialReference,
+                              pyramid='NONE', rasterStatistics='NONE'):
+            out = arcpy.NumPyArrayToRaster(combine, ref.extent.lowerLeft,
+                                           ref.meanCellWidth, ref.meanCellHeight,
+                                           value_to_nodata=0)
+            out.save(out_raster)
+    finally:
+        # also reached if a read or np.unique fails part way through the tile,
+        # the map has to be closed before Windows will delete the file
+        del combine
+        os.remove(combine_file)
+
+
+# gives each worker one scratch gdb that is reused for every area it runs
+# instead of a new _temp.gdb per area, made the first time it's asked for
+def WorkerGdb(logger):
+    global worker_temp_gdb
+    if worker_temp_gdb is None:
+        gdb = f'{creation_dir}/Vectors_temp/worker_{os.getpid()}.gdb'
+        if not arcpy.Exists(gdb):
+            retry = utils.Retry(logger, tries=5, wait=1, backoff=2)
+            retry(arcpy.CreateFileGDB_management)(out_folder_path=os.path.dirname(gdb),
+                                                  out_name=os.path.basename(gdb),
+                                                  out_version="CURRENT")
+        worker_temp_gdb = gdb
+    return worker_temp_gdb
+
+
+# ProcessPoolExecutor initializer, makes the worker's scratch gdb up front
+def InitWorker():
+    # no area logger exists yet, so failures go straight to overall_error.txt
+    logger = logging.getLogger(f'worker_{os.getpid()}')
+    error_handler = logging.FileHandler(f'{creation_dir}/log/overall_error.txt', mode='a', delay=True)
+    error_handler.setLevel(logging.ERROR)
+    error_handler.setFormatter(logging.Formatter("%(name)s %(asctime)s - %(message)s"))
+    logger.addHandler(error_handler)
+    try:
+        WorkerGdb(logger)
+    except Exception:
+        # an initializer that raises breaks the whole pool, so leave
+        # worker_temp_gdb unset and let CSB_process try again per area
+        pass
+    finally:
+        logger.removeHandler(error_handler)
+        error_handler.close()
 
-    t2 = time.perf_counter()
-    print(f'Time that Elimination takes for {area}: {round((t2 - t1) / 60, 2)} minutes')
-    logger.info(f'Time that Elimination takes for {area}: {round((t2 - t1) / 60, 2)} minutes')
 
-    for i in range(len(file_lst)):
-        logger.info(f"{area}_{i}: Select analysis")
-        arcpy.Select_analysis(
-            in_features=f'{creation_dir}/Vectors_Out/{area}_{start_year}-{end_year}_OUT.gdb/Out_{area}_{i}_In',
-            out_feature_class=f'{creation_dir}/Vectors_Out/{area}_{i}_{start_year}_{end_year}_Out.shp',
-            where_clause="Shape_Area >10000")
+# Shape_Area thresholds (square meters) for each elimination pass
+elimination_areas = [100, 1000, 10000, 10000]
 
-    t3 = time.perf_counter()
-    print(f'Total time for {area}: {round((t3 - t0) / 60, 2)} minutes')
-    logger.info(f'Total time for {area}: {round((t3 - t0) / 60, 2)} minutes')
-    return(f'Finished {area}')
+
+# raised by CSBElimination with the name of the tile it was eliminating
+class EliminationError(Exception):
+    def __init__(self, tile, error):
+        # both go in args so the error still pickles back to the pool parent
+        super().__init__(tile, error)
+        self.tile = tile
 
 
 # Arcgis toolbox code that performs polygon elimination
-def CSBElimination(Input_Layers, Workspace, Scratch):  
-
-    # To allow overwriting outputs change overwriteOutput option to True.
-    arcpy.env.overwriteOutput = True
-
-    for FeatureClass, Name in FeatureClassGenerator(Input_Layers, "", "POLYGON", "NOT_RECURSIVE"):
-
-        # Process: Make Feature Layer (Make Feature Layer) (management)
-        _Name_Layer = f"{Name}"
-        with arcpy.EnvManager(outputCoordinateSystem=Output_Coordinate_System_2_):
-            arcpy.management.MakeFeatureLayer(in_features=FeatureClass, out_layer=_Name_Layer, where_clause="",
-                                              workspace="", field_info="")
-
-        # Process: Select Layer By Attribute (Select Layer By Attribute) (management)
-        with arcpy.EnvManager(outputCoordinateSystem=Output_Coordinate_System_2_):
-            Selected = arcpy.management.SelectLayerByAttribute(in_layer_or_view=_Name_Layer,
-                                                               selection_type="NEW_SELECTION",
-                                                               where_clause="Shape_Area <=100", invert_where_clause="")
-
-        # Process: Eliminate (Eliminate) (management)
-        _Name_temp1 = fr"{Scratch}\{Name}_temp1"
-        if Selected:
-            with arcpy.EnvManager(outputCoordinateSystem=Output_Coordinate_System_2_):
-                arcpy.management.Eliminate(in_features=Selected, out_feature_class=_Name_temp1, selection="LENGTH",
-                                           ex_where_clause="", ex_features="")
-
-        # Process: Make Feature Layer (2) (Make Feature Layer) (management)
-        input2 = f"{Name}_temp1_Layer"
-        if Selected:
-            with arcpy.EnvManager(outputCoordinateSystem=Output_Coordinate_System_2_):
-                arcpy.management.MakeFeatureLayer(in_features=_Name_temp1, out_layer=input2, where_clause="",
+def CSBElimination(Input_Layers, Workspace, Scratch, area_logger):  
+
+    # one env scope for every feature class, overwriteOutput is only on here
+    # rather than left set on the worker for later areas
+    # Out_<Name> is only written by a tile's last pass and CSB_process deletes
+    # the failed tile's before a retry, so tiles that still have one finished
+    # and are not eliminated again
+    with arcpy.EnvManager(workspace=Workspace):
+        done_FCs = set(arcpy.ListFeatureClasses())
+
+    with arcpy.EnvManager(outputCoordinateSystem=Output_Coordinate_System_2_, overwriteOutput=True):
+        for FeatureClass, Name in FeatureClassGenerator(Input_Layers, "", "POLYGON", "NOT_RECURSIVE"):
+            if f'Out_{Name}' in done_FCs:
+                continue
+
+            # Process: Make Feature Layer (Make Feature Layer) (management)
+            # one layer name is reused for every pass, it is only re-pointed
+            # when a pass actually writes new polygons
+            in_features = FeatureClass
+            in_layer = f"{Name}_Layer"
+            temp_features = []
+            # report which tile failed so RepairTopology repairs that one
+            try:
+                arcpy.management.MakeFeatureLayer(in_features=in_features, out_layer=in_layer, where_clause="",
                                                   workspace="", field_info="")
 
-        # Process: Select Layer By Attribute (2) (Select Layer By Attribute) (management)
-        if Selected:
-            with arcpy.EnvManager(outputCoordinateSystem=Output_Coordinate_System_2_):
-                Selected_2_ = arcpy.management.SelectLayerByAttribute(in_layer_or_view=input2,
-                                                                      selection_type="NEW_SELECTION",
-                                                                      where_clause="Shape_Area <=1000",
-                                                                      invert_where_clause="")
-
-        # Process: Eliminate (2) (Eliminate) (management)
-        _Name_temp2 = fr"{Scratch}\{Name}_temp2"
-        if Selected and Selected_2_:
-            with arcpy.EnvManager(outputCoordinateSystem=Output_Coordinate_System_2_):
-                arcpy.management.Eliminate(in_features=Selected_2_, out_feature_class=_Name_temp2, selection="LENGTH",
-                                           ex_where_clause="", ex_features="")
-
-        # Process: Make Feature Layer (3) (Make Feature Layer) (management)
-        temp2_Layer = f"{Name}_temp2_Layer"
-        if Selected and Selected_2_:
-            arcpy.management.MakeFeatureLayer(in_features=_Name_temp2, out_layer=temp2_Layer, where_clause="",
-                                              workspace="", field_info="")
-
-        # Process: Select Layer By Attribute (3) (Select Layer By Attribute) (management)
-        if Selected and Selected_2_:
-            Selected_3_ = arcpy.management.SelectLayerByAttribute(in_layer_or_view=temp2_Layer,
-                                                                  selection_type="NEW_SELECTION",
-                                                                  where_clause="Shape_Area <=10000",
-                                                                  invert_where_clause="")
-
-        # Process: Eliminate (3) (Eliminate) (management)
-        _Name_temp3 = fr"{Scratch}\{Name}_temp3"
-        if Selected and Selected_2_ and Selected_3_:
-            arcpy.management.Eliminate(in_features=Selected_3_, out_feature_class=_Name_temp3, selection="LENGTH",
-                                       ex_where_clause="", ex_features="")
-
-        # Process: Make Feature Layer (4) (Make Feature Layer) (management)
-        input2_2_ = f"{Name}_temp3_Layer"
-        if Selected and Selected_2_ and Selected_3_:
-            arcpy.management.MakeFeatureLayer(in_features=_Name_temp3, out_layer=input2_2_, where_clause="",
-                                              workspace="", field_info="")
-
-        # Process: Select Layer By Attribute (4) (Select Layer By Attribute) (management)
-        if Selected and Selected_2_ and Selected_3_:
-            Selected_4_ = arcpy.management.SelectLayerByAttribute(in_layer_or_view=input2_2_,
-                                                                  selection_type="NEW_SELECTION",
-                                                                  where_clause="Shape_Area <=10000",
-                                                                  invert_where_clause="")
-
-        # Process: Eliminate (4) (Eliminate) (management)
-        Out_Name_ = fr"{Workspace}\Out_{Name}"
-        if Selected and Selected_2_ and Selected_3_ and Selected_4_:
-            arcpy.management.Eliminate(in_features=Selected_4_, out_feature_class=Out_Name_, selection="LENGTH",
-                                       ex_where_clause="", ex_features="")
+                for n, max_area in enumerate(elimination_areas, start=1):
+                    # last pass writes to the Out gdb, earlier passes to scratch
+                    last_pass = n == len(elimination_areas)
+                    if last_pass:
+                        out_features = fr"{Workspace}\Out_{Name}"
+                    else:
+                        out_features = fr"{Scratch}\{Name}_temp{n}"
+
+                    # nothing left to eliminate at this size, the next pass keeps
+                    # using the same polygons and layer so only the last pass has
+                    # to write them out. The cursor stops at the first small polygon
+                    # instead of counting them all
+                    where_clause = f"Shape_Area <={max_area}"
+                    with arcpy.da.SearchCursor(in_features, ["OID@"], where_clause=where_clause) as cursor:
+                        has_small = next(cursor, None) is not None
+                    if not has_small:
+                        if last_pass:
+                            arcpy.management.CopyFeatures(in_features, out_features)
+                        continue
+
+                    # Process: Select Layer By Attribute (Select Layer By Attribute) (management)
+                    Selected = arcpy.management.SelectLayerByAttribute(in_layer_or_view=in_layer,
+                                                                       selection_type="NEW_SELECTION",
+                                                                       where_clause=where_clause,
+                                                                       invert_where_clause="")
+
+                    # Process: Eliminate (Eliminate) (management)
+                    arcpy.management.Eliminate(in_features=Selected, out_feature_class=out_features, selection="LENGTH",
+                                               ex_where_clause="", ex_features="")
+
+                    # Process: Make Feature Layer (Make Feature Layer) (management)
+                    if not last_pass:
+                        temp_features.append(out_features)
+                        in_features = out_features
+                        arcpy.management.MakeFeatureLayer(in_features=in_features, out_layer=in_layer, where_clause="",
+                                                          workspace="", field_info="")
+            except Exception as e:
+                raise EliminationError(Name, e) from e
+
+            # Out_<Name> is written, so this tile's passes are no longer needed.
+            # leftover temps only sit in memory\ until the next area clears it and
+            # the layer is only a reference, so a failed cleanup is logged
+            # rather than failing the area
+            try:
+                arcpy.management.Delete([in_layer] + temp_features)
+            except Exception as e:
+                area_logger.error(f'{Name}: cleanup failed {e.args}')
 
 
 # FeatureClassGenerator function used by CSBElimination arc toolbox
@@ -349,7 +386,7 @@ def FeatureClassGenerator(workspace, wild_card, feature_type, recursive) :
   with arcpy.EnvManager(workspace = workspace):
 
     dataset_list = [""]
-    if recursive:
+    if recursive == "RECURSIVE":
       datasets = arcpy.ListDatasets()
       dataset_list.extend(datasets)
 
@@ -359,73 +396,66 @@ def FeatureClassGenerator(workspace, wild_card, feature_type, recursive) :
         yield os.path.join(workspace, dataset, fc), fc
 
 
-# this inspects the <area>_temp.gdb where the topology error happened
-# identifies the problem area and repairs the it in the <area>_In.gdb
-def RepairTopology(in_gdb, temp_gdb, area, area_logger):
-    arcpy.env.workspace = temp_gdb
-    temp_FCs = arcpy.ListFeatureClasses()
-    
-    # find the area that doesn't have 3 FCs in temp (eg one that failed)
-    area_FCs = []
-    for fc in temp_FCs:
-        split_fc = fc.split('_')
-        new_fc = f'{split_fc[0]}_{split_fc[1]}'
-        area_FCs.append(new_fc)
-        
-    areas = np.unique(area_FCs)
-    for a in areas:
-        freq = op.countOf(area_FCs, a)
-        if freq < 3:
-            repair_area = a
-    
+# this repairs the feature class elimination stopped on when the topology error
+# happened in the <area>_In.gdb, the tile comes from CSBElimination's EliminationError
+def RepairTopology(in_gdb, repair_area, area_logger):
     repair_msg = f'{repair_area}: Running repair geometry'
     print(repair_msg); area_logger.info(repair_msg)
     
-    arcpy.RepairGeometry_management(f'{in_gdb}/{repair_area}_In')
+    arcpy.RepairGeometry_management(f'{in_gdb}/{repair_area}')
     
     success_msg = f'{repair_area}: Repair geometry successful. Running Elimination again'
     print(success_msg); area_logger.info(success_msg)
 
 
-# Magic function used in kicking off and joining multiprocessing items
-def chunks(l, n):
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
-
-
-
 if __name__ == '__main__':
 
     # Get Creation and Split_raster paths from csb-default.ini
-    cfg = utils.GetConfig('default')
     split_rasters = f'{cfg["folders"]["split_rasters"]}'
     print(f'Split raster folder: {split_rasters}')
-    # get list of area files 
-    file_obj = Path(f'{split_rasters}/{start_year}/').rglob(f'*.tif')
-    file_lst = [x.__str__().split(f'{start_year}')[1][1:-1] for x in file_obj]
-    print(len(file_lst))
-    
     # delete old files from previous run if doing partial run
     if partial_area != 'None':
-        file_lst = [x for x in file_lst if x == partial_area]
         csb_yrs = creation_dir.split('_')[-3]
         start_year = f'20{csb_yrs[0:2]}'
         end_year = f'20{csb_yrs[2:5]}'
         utils.DeletusGDBus(partial_area, creation_dir)
     
-    # Kick off multiple instances of CSB_Process by area
-    processes = []
-    for area in np.unique(file_lst):
-        p = multiprocessing.Process(target=CSB_process, args=[start_year, end_year, area])
-        processes.append(p)
-    
     # get number of CPUs to use in run
     cpu_prct = float(cfg['global']['cpu_prct'])
     run_cpu = int(round( cpu_prct * multiprocessing.cpu_count(), 0 ))
     print(f'Number of CPUs: {run_cpu}')
-    for i in chunks(processes, run_cpu):
-        for j in i:
-            j.start()
-        for j in i:
-            j.join()
-            
\ No newline at end of file
+    
+    # get the areas, their number of tiles and their total tile size on disk,
+    # used as a proxy for how long each area takes to run
+    area_sizes = {}
+    area_tiles = {}
+    for tif in utils.ScanTifs(f'{split_rasters}/{start_year}'):
+        m = split_raster_re.match(tif.name)
+        if m is None:
+            continue
+        if partial_area != 'None' and m['area'] != partial_area:
+            continue
+        area_sizes[m['area']] = area_sizes.get(m['area'], 0) + tif.stat().st_size
+        area_tiles[m['area']] = area_tiles.get(m['area'], 0) + 1
+    print(len(area_sizes))
+    
+    # Kick off CSB_process by area on a pool of persistent workers, each worker
+    # loads arcpy once when it starts instead of once per area. Largest areas
+    # are submitted first so small ones fill in at the end instead of one big
+    # area running alone
+    with ProcessPoolExecutor(max_workers=run_cpu, initializer=InitWorker) as executor:
+        futures = {executor.submit(CSB_process, start_year, end_year, area, area_tiles[area]): area
+                   for area in sorted(area_sizes, key=area_sizes.get, reverse=True)}
+        
+        failed_areas = []
+        for future in as_completed(futures):
+            try:
+                print(future.result())
+            except Exception as e:
+                failed_areas.append((futures[future], repr(e)))
+                print(f'{futures[future]}: failed, see log/overall_error.txt and log/failed_areas.txt')
+    
+    # one list of the areas that need a partial run, written once by the parent
+    if failed_areas:
+        with open(f'{creation_dir}/log/failed_areas.txt', 'w') as f:
+            f.write(''.join(f'{area}\t{error}\n' for area, error in sorted(failed_areas)))
@@ -44,7 +44,12 @@ logging.basicConfig(filename=distribute_dir + f'/log/CSB_Distribute.log',
                     format=LOG_FORMAT,
                     filemode='a')  # over write instead of appending
 logger = logging.getLogger()
-error_path = distribute_dir + f'/log/overall_error.txt'
+# errors also go to the run's overall_error.txt, the handler keeps the file
+# open instead of reopening it per error
+error_handler = logging.FileHandler(distribute_dir + f'/log/overall_error.txt', mode='a', delay=True)
+error_handler.setLevel(logging.ERROR)
+error_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+logger.addHandler(error_handler)
 
 # %%  Creating single file gdb for the National Subregion folder
 national_sub_gdb = arcpy.CreateFileGDB_management(subregion_path, f'Sub_CSB{csb_year}' + '.gdb')[0]
@@ -83,9 +88,6 @@ for gdb in file_lst:
         except Exception as e:
             error_msg = e.args
             logger.error(error_msg)
-            f = open(error_path,'a')
-            f.write(''.join(str(item) for item in error_msg))
-            f.close()
             print(f'first error: {error_msg}')
             if 'ERROR 002598: Name: "CSBACRES" already exists' in error_msg:
                 process = True
@@ -93,9 +95,6 @@ for gdb in file_lst:
         except:
             error_msg = arcpy.GetMessage(0)
             logger.error(error_msg)
-            f = open(error_path,'a')
-            f.write(''.join(str(item) for item in error_msg))
-            f.close()
             print(f'2nd error: {error_msg}')
             if 'ERROR 002598: Name: "CSBACRES" already exists' in error_msg:
                 process = True
@@ -119,16 +118,10 @@ while merge_process is False:
     except Exception as e:
         error_msg = e.args
         logger.error(error_msg)
-        f = open(error_path,'a')
-        f.write(''.join(str(item) for item in error_msg))
-        f.close()
     
     except:
         error_msg = arcpy.GetMessage(0)
         logger.error(error_msg)
-        f = open(error_path,'a')
-        f.write(''.join(str(item) for item in error_msg))
-        f.close()
        
         
 t4 = time.perf_counter()
@@ -149,16 +142,10 @@ while calculate_field == False:
     except Exception as e:
         error_msg = e.args
         logger.error(error_msg)
-        f = open(error_path,'a')
-        f.write(''.join(str(item) for item in error_msg))
-        f.close()
        
     except:
         error_msg = arcpy.GetMessage(0)
         logger.error(error_msg)
-        f = open(error_path,'a')
-        f.write(''.join(str(item) for item in error_msg))
-        f.close()
        
         
 t6 = time.perf_counter()
@@ -202,16 +189,10 @@ while merge_process is False:
     except Exception as e:
         error_msg = e.args
         logger.error(error_msg)
-        f = open(error_path,'a')
-        f.write(''.join(str(item) for item in error_msg))
-        f.close()
        
     except:
         error_msg = arcpy.GetMessage(0)
         logger.error(error_msg)
-        f = open(error_path,'a')
-        f.write(''.join(str(item) for item in error_msg))
-        f.close()
        
 
 t8 = time.perf_counter()
@@ -255,16 +236,10 @@ for STATE in states:
         except Exception as e:
             error_msg = e.args
             logger.error(error_msg)
-            f = open(error_path,'a')
-            f.write(''.join(str(item) for item in error_msg))
-            f.close()
            
         except:
             error_msg = arcpy.GetMessage(0)
             logger.error(error_msg)
-            f = open(error_path,'a')
-            f.write(''.join(str(item) for item in error_msg))
-            f.close()
                    
     t2 = time.perf_counter()
     print(f'{STATE}: takes {round((t2 - t1) / 60, 2)} minutes')
@@ -1,9 +1,11 @@
 import shutil
 import os
 import sys
+import time
 import configparser
 import multiprocessing
 import datetime as dt
+import functools
 
 
 # get arguments from sys.arg in CSB-Run.py
@@ -36,6 +38,8 @@ def GetArgs(sys_argv):
 
 
 # get CSB-Run configuration file, will choose default if none provided
+# cached so repeated calls in a process don't re-read the ini from disk
+@functools.lru_cache(maxsize=4)
 def GetConfig(config_arg):
     config_dir = f'{os.getcwd()}/config'
 
@@ -97,73 +101,41 @@ def SetRunParams(config, args):
     return arcgis_env, script, creation_dir, partial_area
     
 
+# subfolders BuildFolders makes in a new run directory for each workflow
+creation_run_folders = ('Combine','CombineAll','Merge','Vectors_In','Vectors_LL',
+                        'Vectors_Out','Vectors_temp','log','Raster_Out')
+run_folders = {'create': creation_run_folders,
+               'create_test': creation_run_folders,
+               'prep': ('National_Subregion_gdb','Subregion_gdb','National_gdb','log'),
+               'distribute': ('National_Final_gdb','State_gdb','State','log','State/tif_state_extent')}
+
+
 # function that builds folders for a CSB run
 def BuildFolders(creation_dir, workflow):
-    creation_folders = ['Combine','CombineAll','Merge','Vectors_In','Vectors_LL',
-                        'Vectors_Out','Vectors_temp','log','Raster_Out']
-    prep_folders = ['National_Subregion_gdb','Subregion_gdb','National_gdb','log']
-    distribute_folders = ['National_Final_gdb','State_gdb','State','log','State/tif_state_extent']
-    
     run_folder = creation_dir.split('/')[-1]
     base_dir = creation_dir.replace(run_folder,'')
-    files = [f for f in os.listdir(base_dir) if f.startswith(run_folder)]
     
-    # get folder name
-    if len(files) > 0:
-        # condition for picking right file
-        version = [int(f.split('_')[-1]) for f in files if f.startswith(run_folder)]
-        
-        new_version = max(version) + 1
-        
-    else:
-        new_version = 1
+    # get folder name, one more than the highest existing version of this run.
+    # only plain version suffixes count, so renamed runs like ..._1BAD are skipped
+    new_version = 1
+    with os.scandir(base_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith(run_folder):
+                suffix = entry.name[len(run_folder):]
+                if suffix.isdigit():
+                    new_version = max(new_version, int(suffix) + 1)
             
     # actual run directory name
     run_dir = f'{base_dir}{run_folder}{new_version}'
     
     
-    # build appropriate folders
-    if workflow == 'create' or workflow == 'create_test':
-        try:
-            os.makedirs(run_dir)
-        except:
-            pass
-        # create subfolders
-        if os.path.exists(run_dir):
-            for f in creation_folders:
-                try:
-                    os.mkdir(f'{run_dir}/{f}')
-                except:
-                    pass
-        print(f'Directory built: {run_dir}')
-        
-    elif workflow == 'prep':
-        try:
-            os.makedirs(run_dir)
-        except:
-            pass
-        
-        if os.path.exists(run_dir):
-            for f in prep_folders:
-                try:
-                    os.mkdir(f'{run_dir}/{f}')
-                except:
-                    pass
-                    
-                
-
-    elif workflow == 'distribute':
-        try:
-            os.makedirs(run_dir)
-        except:
-            pass
-        
-        if os.path.exists(run_dir):
-            for f in distribute_folders:
-                try:
-                    os.mkdir(f'{run_dir}/{f}')
-                except:
-                    pass  
+    # build appropriate folders, makedirs also creates run_dir with the first
+    # subfolder and existing folders are left as they are
+    if workflow in run_folders:
+        for f in run_folders[workflow]:
+            os.makedirs(f'{run_dir}/{f}', exist_ok=True)
+        if workflow.startswith('create'):
+            print(f'Directory built: {run_dir}')
     
     elif workflow == 'create_partial':
         run_dir = creation_dir
@@ -189,27 +161,65 @@ def GetRunFolder(workflow, start_year, end_year):
         prefix = 'prep'
     
     files_prefix = f'{prefix}_{str(start_year)[2:]}{str(end_year)[2:]}_'
-    files = [f for f in os.listdir(create_path) if f.startswith(files_prefix) \
-             and not f.endswith('BAD')]
-    file_date_list = []
-    for f in files:
-        file_list = f.split('_')
-        file_date = file_list[2]
-        file_date = dt.datetime.strptime(file_date, '%Y%m%d')
-        file_date_list.append(file_date)
-    
-    latest_date = max(file_date_list)
-    latest_indeces = [i for i,x in enumerate(file_date_list) if x == latest_date]
-    latest_files = [files[i] for i in latest_indeces]
-    # this assumes the latest is the last in the list from os.listdir
-    if len(files) > 0:
-        run_path = f'{create_path}/{latest_files[-1]}'
+    
+    # run dates are YYYYMMDD so they compare as strings the same as dates,
+    # keep the latest in one pass. Ties go to the last in the listing
+    run_path = None
+    latest_date = ''
+    with os.scandir(create_path) as entries:
+        for entry in entries:
+            f = entry.name
+            if not f.startswith(files_prefix) or f.endswith('BAD'):
+                continue
+            file_date = f.split('_')[2]
+            if file_date >= latest_date:
+                latest_date = file_date
+                run_path = f'{create_path}/{f}'
+    
+    if run_path is not None:
         return run_path
     else:
         print('No create directory found for given years')
         quit()
 
 
+# decorator that retries an arcpy step until it works, logging each failure to
+# the logger (which should have a handler on the run's overall_error.txt).
+# tries=None keeps trying forever like the inline while/try loops it replaces,
+# otherwise the last error is raised. The wait between attempts is multiplied
+# by backoff after each failure, up to max_wait seconds
+def Retry(logger, tries=None, wait=0, backoff=1, max_wait=30):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            attempt = 0
+            delay = wait
+            while True:
+                attempt += 1
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    logger.error(e.args)
+                    if tries is not None and attempt >= tries:
+                        raise
+                    time.sleep(delay)
+                    delay = min(delay * backoff, max_wait)
+        return wrapper
+    return decorator
+
+
+# walk a folder with os.scandir and yield a DirEntry for each .tif file in it,
+# DirEntry caches the file type (and on Windows the size) so this avoids a
+# stat and a Path per entry
+def ScanTifs(folder):
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                yield from ScanTifs(entry.path)
+            elif entry.name.lower().endswith('.tif'):
+                yield entry
+
+
 def DeletusGDBus(area, directory):
     # relevant folders are in create directory currently
     creation_folders = ['Combine','CombineAll','Merge','Vectors_In','Vectors_LL',
@@ -218,13 +228,14 @@ def DeletusGDBus(area, directory):
     print(f'Deleting old files for {area}')
     
     for folder in creation_folders:
-        check_folder = f'{directory}/{folder}'
-        for f in os.listdir(check_folder):
-            if f.startswith( f'{area}_'):
-                if f.endswith( '.gdb' ):
-                    shutil.rmtree( f'{check_folder}/{f}')
-                else:
-                    os.remove( f'{check_folder}/{f}')
+        with os.scandir(f'{directory}/{folder}') as entries:
+            for entry in entries:
+                if entry.name.startswith(f'{area}_'):
+                    # gdbs are folders, DirEntry already knows which is which
+                    if entry.is_dir():
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.remove(entry.path)
     
            
 # determine multiprocessing batch size 